@@ -8,13 +8,56 @@ __email__ = "support@contraxsuite.com"
 
 import datetime
 import itertools
+from functools import lru_cache
 
 import joblib
-from typing import List, Tuple, Callable, Dict, Union, Set, Optional
+import numpy as np
+from typing import List, NamedTuple, Tuple, Callable, Dict, Union, Set, Optional
 import regex as re
 
-REG_WORD_SEPARATOR = re.compile(r'[\s\-\.\[\]\{\}\(\),;:\+\\/]+')
+_WORD_SEPARATOR_CHARS = r'\s\-\.\[\]\{\}\(\),;:\+\\/'
+REG_WORD_SEPARATOR = re.compile(f'[{_WORD_SEPARATOR_CHARS}]+')
 REG_NUMBER = re.compile(r'^\d+')
+# a word between REG_WORD_SEPARATOR matches, "number" group holds the word's leading digits
+REG_DATE_WORD = re.compile(f'(?=[^{_WORD_SEPARATOR_CHARS}])(?P<number>\\d*)[^{_WORD_SEPARATOR_CHARS}]*')
+
+WORD_FEATURE_KEYS = ['nb31', 'na31', 'wr_l', 'wr_u']
+
+# encodings encode_date_feature_text supports: encoding errors handler and code unit type.
+# latin-1 takes a quarter of utf-32 memory but replaces other characters with "?",
+# so it only suits model characters within latin-1 that don't include "?"
+DATE_FEATURE_TEXT_ENCODINGS: Dict[str, Tuple[str, type]] = {
+    'utf-32-le': ('surrogatepass', np.uint32),
+    'latin-1': ('replace', np.uint8),
+}
+
+
+class CharIndex(NamedTuple):
+    """
+    Feature slots of the unique characters of a feature alphabet.
+    `lookup` maps a code point to the character's slot, or to -1
+    for the code points outside the alphabet (the last item
+    is reserved for all the code points above the alphabet).
+    `weights` tells how many times each character is listed in the alphabet,
+    `repeats` - (slot, weight - 1) pairs for the characters listed more than once.
+    """
+    lookup: np.ndarray
+    keys: List[str]
+    weights: np.ndarray
+    repeats: Tuple[Tuple[int, int], ...]
+
+
+class BigramIndex(NamedTuple):
+    """
+    Feature slots of the unique character bigrams of a feature alphabet.
+    `flat` holds (first char slot * alphabet size + second char slot) for each bigram,
+    `doubled` - (slot, bigram) pairs for the bigrams like "aa".
+    """
+    keys: List[str]
+    flat: np.ndarray
+    weights: np.ndarray
+    repeats: Tuple[Tuple[int, int], ...]
+    doubled: Tuple[Tuple[int, str], ...]
 
 
 def get_date_features(text,
@@ -25,7 +68,11 @@ def get_date_features(text,
                       include_bigrams=True,
                       window=5,
                       norm=True,
-                      count_words=False):
+                      count_words=False,
+                      out_order: Optional[np.ndarray] = None,
+                      text_bytes: Optional[bytes] = None,
+                      text_encoding: str = 'utf-32-le',
+                      out: Optional[np.ndarray] = None) -> Union[Dict[str, float], np.ndarray]:
     """
     Get features to use for classification of date as false positive.
     :param text: raw text around potential date
@@ -37,53 +84,57 @@ def get_date_features(text,
     :param alphabet_char_set: alphabetic characters only for the provided locale
     :param norm: whether to norm, i.e., transform to proportion
     :param count_words: words count in the string
+    :param out_order: feature positions (see get_date_feature_order) - return
+                      a vector of features in this order instead of a dict
+    :param text_bytes: the whole text encoded once with encode_date_feature_text,
+                       saves copying the text window for each date in the text
+    :param text_encoding: encoding of text_bytes, one of DATE_FEATURE_TEXT_ENCODINGS
+    :param out: float64 array to write the feature vector to, used along with out_order
     :return:
     """
-    # Get text window
+    # Get text window, stripped of whitespaces
     window_start = max(0, start_index - window)
     window_end = min(len(text), end_index + window)
-    feature_text = text[window_start:window_end].strip()
-    date_text = text[start_index:end_index]
+    while window_start < window_end and text[window_start].isspace():
+        window_start += 1
+    while window_end > window_start and text[window_end - 1].isspace():
+        window_end -= 1
 
-    # Build character vector
-    char_vec = {}
-    char_keys = []
-    bigram_keys = {}
-    for character in characters:
-        key = f'char_{character}'
-        char_vec[key] = feature_text.count(character)
-        char_keys.append(key)
+    # Count characters and character bigrams in a single pass over the code points
+    alphabet = tuple(characters)
+    char_index = _get_char_index(alphabet)
+    code_type = np.dtype(DATE_FEATURE_TEXT_ENCODINGS[text_encoding][1])
+    if text_bytes is None:
+        codes = np.frombuffer(encode_date_feature_text(text[window_start:window_end], text_encoding),
+                              dtype=code_type)
+    else:
+        codes = np.frombuffer(text_bytes, dtype=code_type,
+                              count=window_end - window_start, offset=code_type.itemsize * window_start)
+    slots = char_index.lookup[np.minimum(codes, len(char_index.lookup) - 1)]
+    known = slots >= 0
+    char_counts = np.bincount(slots[known], minlength=len(char_index.keys))
+    keys = [char_index.keys]
+    values = [_norm_counts(char_counts, char_index.weights, char_index.repeats, norm)]
 
     # Build character bigram vector
     if include_bigrams:
-        bigram_set = [''.join(s) for s in itertools.permutations(characters, 2)]
-        bigram_keys = []
-        for character in bigram_set:
-            key = f'bigram_{character}'
-            char_vec[key] = feature_text.count(character)
-            bigram_keys.append(key)
-
-    # Norm if requested
-    if norm:
-        # Norm by characters
-        char_sum = sum([char_vec[k] for k in char_keys])
-        if char_sum > 0:
-            for key in char_keys:
-                char_vec[key] /= float(char_sum)
-
-        # Norm by bigrams
-        if include_bigrams:
-            bigram_sum = sum([char_vec[k] for k in bigram_keys])
-            if bigram_sum > 0:
-                for key in bigram_keys:
-                    char_vec[key] /= float(bigram_sum)
+        bigram_index = _get_bigram_index(alphabet)
+        size = len(char_index.keys)
+        pairs = slots[:-1] * size + slots[1:]
+        bigram_counts = np.bincount(pairs[known[:-1] & known[1:]],
+                                    minlength=size * size)[bigram_index.flat]
+        # str.count() doesn't count overlapping occurrences of a doubled character
+        for slot, bigram in bigram_index.doubled:
+            bigram_counts[slot] = text[window_start:window_end].count(bigram)
+        keys.append(bigram_index.keys)
+        values.append(_norm_counts(bigram_counts, bigram_index.weights, bigram_index.repeats, norm))
 
     if count_words:
         # calculate numbers below 31, numbers above 31, words and capitalized words
         numbers_above_31, numbers_below_31, words, cap_words = 0, 0, 0, 0
-        for wrd in split_date_words(date_text):  # type: str
-            if not wrd:
-                continue
+        date_text = text[start_index:end_index]
+        for match in REG_DATE_WORD.finditer(date_text):
+            wrd = match.group(0)
             if wrd[0] in alphabet_char_set:
                 is_cap = len(wrd) > 1 and wrd[0].lower() != wrd[0] and wrd[1].lower() == wrd[1]
                 if is_cap:
@@ -91,9 +142,9 @@ def get_date_features(text,
                 else:
                     words += 1
                 continue
-            numbers = [int(n.group(0)) for n in REG_NUMBER.finditer(wrd)]
-            if numbers:
-                if numbers[0] < 31:
+            number = match.group('number')
+            if number:
+                if int(number) < 31:
                     numbers_below_31 += 1
                 else:
                     numbers_above_31 += 1
@@ -102,13 +153,113 @@ def get_date_features(text,
             if sum_words:
                 numbers_above_31, numbers_below_31, words, cap_words = \
                     numbers_above_31 / sum_words, numbers_below_31 / sum_words, words / sum_words, cap_words / sum_words
-        char_vec['nb31'] = numbers_below_31
-        char_vec['na31'] = numbers_above_31
-        char_vec['wr_l'] = words
-        char_vec['wr_u'] = cap_words
+        keys.append(WORD_FEATURE_KEYS)
+        values.append(np.array([numbers_below_31, numbers_above_31, words, cap_words]))
 
+    if out_order is not None:
+        vector = np.empty(sum(len(part_values) for part_values in values), dtype=np.float64)
+        position = 0
+        for part_values in values:
+            vector[position:position + len(part_values)] = part_values
+            position += len(part_values)
+        return np.take(vector, out_order, out=out)
+
+    char_vec = {}
+    for part_keys, part_values in zip(keys, values):
+        char_vec.update(zip(part_keys, part_values.tolist()))
     return char_vec
 
 
+def encode_date_feature_text(text: str, encoding: str = 'utf-32-le') -> bytes:
+    """
+    Encode text to the fixed width code points get_date_features counts.
+    :param encoding: one of DATE_FEATURE_TEXT_ENCODINGS, pass the same one to get_date_features
+    """
+    return text.encode(encoding, DATE_FEATURE_TEXT_ENCODINGS[encoding][0])
+
+
+def get_date_feature_order(columns: List[str],
+                           characters: List[str],
+                           include_bigrams=True,
+                           count_words=False) -> np.ndarray:
+    """
+    Get positions of the columns (feature names the classifier model was trained on)
+    in the feature vector built by get_date_features with the same arguments.
+    The result is meant to be calculated once and passed to get_date_features as `out_order`.
+    """
+    names = list(_get_char_index(tuple(characters)).keys)
+    if include_bigrams:
+        names += _get_bigram_index(tuple(characters)).keys
+    if count_words:
+        names += WORD_FEATURE_KEYS
+    position_by_name = {name: i for i, name in enumerate(names)}
+    return np.array([position_by_name[column] for column in columns], dtype=np.int64)
+
+
+@lru_cache(maxsize=8)
+def _get_char_index(characters: Tuple[str, ...]) -> CharIndex:
+    slot_by_char: Dict[str, int] = {}
+    keys: List[str] = []
+    weights: List[int] = []
+    for character in characters:
+        slot = slot_by_char.get(character)
+        if slot is None:
+            slot = slot_by_char[character] = len(keys)
+            keys.append(f'char_{character}')
+            weights.append(0)
+        weights[slot] += 1
+
+    lookup = np.full(max(map(ord, slot_by_char), default=0) + 2, -1, dtype=np.int64)
+    for character, slot in slot_by_char.items():
+        lookup[ord(character)] = slot
+    return CharIndex(lookup, keys, np.array(weights, dtype=np.int64), _get_repeats(weights))
+
+
+@lru_cache(maxsize=8)
+def _get_bigram_index(characters: Tuple[str, ...]) -> BigramIndex:
+    char_index = _get_char_index(characters)
+    size = len(char_index.keys)
+    slot_by_key: Dict[str, int] = {}
+    keys: List[str] = []
+    flat: List[int] = []
+    weights: List[int] = []
+    doubled: List[Tuple[int, str]] = []
+    for first, second in itertools.permutations(characters, 2):
+        key = f'bigram_{first}{second}'
+        slot = slot_by_key.get(key)
+        if slot is None:
+            slot = slot_by_key[key] = len(keys)
+            keys.append(key)
+            flat.append(char_index.lookup[ord(first)] * size + char_index.lookup[ord(second)])
+            weights.append(0)
+            if first == second:
+                doubled.append((slot, first + second))
+        weights[slot] += 1
+    return BigramIndex(keys, np.array(flat, dtype=np.int64), np.array(weights, dtype=np.int64),
+                       _get_repeats(weights), tuple(doubled))
+
+
+def _get_repeats(weights: List[int]) -> Tuple[Tuple[int, int], ...]:
+    return tuple((slot, weight - 1) for slot, weight in enumerate(weights) if weight > 1)
+
+
+def _norm_counts(counts: np.ndarray,
+                 weights: np.ndarray,
+                 repeats: Tuple[Tuple[int, int], ...],
+                 norm: bool) -> np.ndarray:
+    """
+    Transform counts to proportions. A feature listed N times in the alphabet
+    is counted N times in the total and is divided by the total N times.
+    """
+    total = int(np.dot(counts, weights))
+    if not norm or total <= 0:
+        return counts
+    values = counts / float(total)
+    for slot, repeat in repeats:
+        for _ in range(repeat):
+            values[slot] /= float(total)
+    return values
+
+
 def split_date_words(date_str: str) -> List[str]:
     return REG_WORD_SEPARATOR.split(date_str)
@@ -6,8 +6,10 @@ __maintainer__ = "LexPredict, LLC"
 __email__ = "support@contraxsuite.com"
 
 
+import string
 from unittest import TestCase
-from lexnlp.extract.common.dates_classifier_model import get_date_features
+from lexnlp.extract.common.dates_classifier_model import get_date_features, get_date_feature_order, \
+    encode_date_feature_text
 from lexnlp.extract.de.date_model import DE_ALPHA_CHAR_SET, DATE_MODEL_CHARS
 
 
@@ -23,3 +25,32 @@ class TestDateClassifierModel(TestCase):
         self.assertEqual(3, features['na31'])
         self.assertEqual(1, features['wr_l'])
         self.assertEqual(4, features['wr_u'])
+
+    def test_feature_vector_order(self):
+        text = 'Wird bis zum 1. Juni 2017 abgeschlossen sein'
+        kwargs = dict(characters=DATE_MODEL_CHARS, count_words=True,
+                      alphabet_char_set=DE_ALPHA_CHAR_SET)
+        features = get_date_features(text, 13, 25, **kwargs)
+        columns = sorted(features)
+        order = get_date_feature_order(columns, DATE_MODEL_CHARS, count_words=True)
+        vector = get_date_features(text, 13, 25, out_order=order, **kwargs)
+        self.assertEqual([features[c] for c in columns], vector.tolist())
+
+    def test_encoded_text_features(self):
+        text = ' Spätestens am  01.06.2017\n ẞ'
+        kwargs = dict(characters=DATE_MODEL_CHARS, count_words=True,
+                      alphabet_char_set=DE_ALPHA_CHAR_SET)
+        for start, end in ((0, len(text)), (15, 26)):
+            self.assertEqual(
+                get_date_features(text, start, end, **kwargs),
+                get_date_features(text, start, end, text_bytes=encode_date_feature_text(text), **kwargs))
+
+    def test_latin1_encoded_text_features(self):
+        text = ' Zahlung 230,55€ fällig am 01.06.2017\n ẞ'
+        characters = list(string.ascii_letters + string.digits + '-/ %#$')
+        for start, end in ((0, len(text)), (27, 37)):
+            self.assertEqual(
+                get_date_features(text, start, end, characters=characters),
+                get_date_features(text, start, end, characters=characters,
+                                  text_bytes=encode_date_feature_text(text, 'latin-1'),
+                                  text_encoding='latin-1'))
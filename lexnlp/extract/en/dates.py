@@ -16,21 +16,24 @@ __email__ = "support@contraxsuite.com"
 # Standard imports
 import calendar
 import datetime
-import locale
-import os
-import random
+import itertools
+import locale as _locale
+from functools import lru_cache
 from logging import getLogger
-from typing import Any, Dict, Generator, List, Optional, Set, Tuple
+from typing import Any, Dict, FrozenSet, Generator, Iterable, List, Optional, Set, Tuple
 
 # Third-party packages
+import numpy as np
 import regex as re
+from joblib import Parallel, delayed
 
 # LexNLP imports
 from lexnlp.extract.all_locales.languages import Locale
 from lexnlp.extract.common.annotations.date_annotation import DateAnnotation
 from lexnlp.extract.common.date_parsing.datefinder import DateFinder
 from lexnlp.extract.common.dates import DateParser
-from lexnlp.extract.common.dates_classifier_model import get_date_features
+from lexnlp.extract.common.dates_classifier_model import encode_date_feature_text, get_date_features, \
+    get_date_feature_order
 from lexnlp.extract.en.date_model import MODEL_DATE, MODULE_PATH, DATE_MODEL_CHARS
 
 logger = getLogger("lexnlp")
@@ -44,6 +47,12 @@ DATE_MERGE_WINDOW = 10
 # Maximum date length
 DATE_MAX_LENGTH = 40
 
+# Number of raw dates to score with a single classifier call
+DATE_CLASSIFIER_BATCH_SIZE = 64
+
+# DATE_MODEL_CHARS are ASCII only, one byte per character is enough to count them
+DATE_FEATURE_TEXT_ENCODING = 'latin-1'
+
 # Setup regular expression for "as of" strings
 AS_OF_PATTERN = r"""
 (made|dated|date)
@@ -56,6 +65,21 @@ of[\s]+?
 
 RE_AS_OF = re.compile(AS_OF_PATTERN, re.IGNORECASE | re.MULTILINE | re.DOTALL | re.VERBOSE)
 
+# Odd date like "1 10"
+RE_TWO_NUMBERS = re.compile(r'\d{1,2}\s+\d{1,2}')
+
+# Date with points like "12.05.2020"
+RE_DOT_DATE = re.compile(r'\d{2}\.\d{2}\.\d{2,4}')
+
+# Odd month from string like "Nil 62. Marquee"
+RE_ODD_MONTH = re.compile(r'\d{2,4}\.\s*[A-Za-z]')
+
+# Delimiters that alone don't make numbers a date like "1, 2" or "1 2"
+NUMBER_DELIMITERS = frozenset({",", " ", "\n", "\t"})
+
+# Ordinal suffixes to remove from "1st", "22nd", "3rd", "4th" day digits
+RE_ORDINAL_SUFFIX = re.compile(r'st|nd|rd|th')
+
 # 'january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec'
 EN_MONTHS = [['january', 'jan'], ['february', 'feb', 'febr'], ['march', 'mar'],
              ['april', 'apr'], ['may'], ['june', 'jun'],
@@ -71,6 +95,19 @@ MONTH_BY_NAME = get_month_by_name()
 
 MONTH_FULLS = {v.lower(): k for k, v in enumerate(calendar.month_name)}
 
+# Positions of MODEL_DATE.columns in the vector built by get_date_features
+DATE_FEATURE_ORDER = get_date_feature_order(MODEL_DATE.columns, DATE_MODEL_CHARS)
+
+
+@lru_cache(maxsize=None)
+def _register_extra_token_replacements() -> None:
+    """
+    Set DateFinder up to replace the extra tokens, once per process.
+    """
+    for extra_token in DateFinder.EXTRA_TOKENS_PATTERN.split('|'):
+        if extra_token != 't':
+            DateFinder.REPLACEMENTS[extra_token] = ' '
+
 
 def get_raw_date_list(text, strict=False, base_date=None, return_source=False, locale=None) -> List:
     return list(get_raw_dates(
@@ -98,12 +135,9 @@ def get_raw_dates(text, strict=False, base_date=None,
             day=1, month=1, hour=0, minute=0, second=0, microsecond=0)
 
     # Find potential dates
+    _register_extra_token_replacements()
     date_finder = DateFinder(base_date=base_date)
 
-    for extra_token in date_finder.EXTRA_TOKENS_PATTERN.split('|'):
-        if extra_token != 't':
-            date_finder.REPLACEMENTS[extra_token] = ' '
-
     # Iterate through possible matches
     possible_dates = list(date_finder.extract_date_strings(text, strict=strict))
     possible_matched = []
@@ -119,11 +153,8 @@ def get_raw_dates(text, strict=False, base_date=None,
             num_dig_mod = len(possible_dates[i - 1][2]["digits_modifier"])
             if i > 0 and not possible_matched[i - 1] and num_dig_mod == 1:
                 date_props["digits_modifier"].extend(possible_dates[i - 1][2]["digits_modifier"])
-                date_string = possible_dates[i - 1][2]["digits_modifier"].pop() \
-                                  .replace("st", "") \
-                                  .replace("nd", "") \
-                                  .replace("rd", "") \
-                                  .replace("th", "") + date_string
+                date_string = RE_ORDINAL_SUFFIX.sub('', possible_dates[i - 1][2]["digits_modifier"].pop()) \
+                              + date_string
 
         # Skip only digits modifiers
         num_dig_mod = len(date_props["digits_modifier"])
@@ -133,6 +164,13 @@ def get_raw_dates(text, strict=False, base_date=None,
         num_slash = date_props["delimiters"].count("/")
         num_point = date_props["delimiters"].count(".")
         num_hyphen = date_props["delimiters"].count("-")
+        extra_tokens = [token for token in date_props["extra_tokens"] if token.lower() not in ("to", "t")]
+        months_lower = date_props["months_lower"] = [month.lower() for month in date_props["months"]]
+
+        # Skip strings too long right away when there are no extra tokens to cut off
+        if not extra_tokens and len(date_string.strip()) > DATE_MAX_LENGTH:
+            possible_matched.append(False)
+            continue
 
         # Remove double months
         if num_month > 1:
@@ -161,17 +199,17 @@ def get_raw_dates(text, strict=False, base_date=None,
             continue
 
         # Skip odd date like "1 10"
-        if re.match(r'\d{1,2}\s+\d{1,2}', date_string):
+        if RE_TWO_NUMBERS.match(date_string):
             possible_matched.append(False)
             continue
 
         # Skip floats
-        if num_point and not num_month and not re.match(r'\d{2}\.\d{2}\.\d{2,4}', date_string):
+        if num_point and not num_month and not RE_DOT_DATE.match(date_string):
             possible_matched.append(False)
             continue
 
         # Skip odd months from string like "Nil 62. Marquee"
-        if re.search(r'\d{2,4}\.\s*[A-Za-z]', date_string):
+        if RE_ODD_MONTH.search(date_string):
             possible_matched.append(False)
             continue
 
@@ -193,7 +231,7 @@ def get_raw_dates(text, strict=False, base_date=None,
             continue
 
         # Skip "may" alone
-        if num_dig == 0 and num_days == 0 and "".join(date_props["months"]).lower() == "may":
+        if num_dig == 0 and num_days == 0 and "".join(months_lower) == "may":
             possible_matched.append(False)
             continue
 
@@ -201,16 +239,14 @@ def get_raw_dates(text, strict=False, base_date=None,
         if (
                 num_dig > 0
                 and (num_point + num_slash + num_hyphen) > 0
-                and "".join(date_props["months"]).lower() == "may"
+                and "".join(months_lower) == "may"
         ):
             possible_matched.append(False)
             continue
 
         # Cleanup
-        for token in sorted(date_props["extra_tokens"], key=len, reverse=True):
-            if token.lower() in ["to", "t"]:
-                continue
-            date_string = date_string.replace(token, "")
+        if extra_tokens:
+            date_string = get_extra_tokens_regex(frozenset(extra_tokens)).sub("", date_string)
         date_string = date_string.strip()
         date_props["extra_tokens"] = []
 
@@ -220,40 +256,27 @@ def get_raw_dates(text, strict=False, base_date=None,
             continue
 
         # Skip numbers only
-        match_delims = set("".join(date_props["delimiters"]))
-        bad_delims = {",", " ", "\n", "\t"}
-        len_diff_set = len(match_delims - bad_delims)
-        if len_diff_set == 0 and num_month == 0:
+        if num_month == 0 and all(char in NUMBER_DELIMITERS
+                                  for delimiter in date_props["delimiters"] for char in delimiter):
             possible_matched.append(False)
             continue
 
         # Parse and skip nones
-        date = None
-        try:
-            date_string_tokens = date_string.split()
-            for cutter in range(len(date_string_tokens)):
-                for direction in (0, 1):
-                    if cutter > 0:
-                        if direction:
-                            _date_string_tokens = date_string_tokens[cutter:]
-                        else:
-                            _date_string_tokens = date_string_tokens[:-cutter]
-                        date_string = ' '.join(_date_string_tokens)
-                    try:
-                        date = date_finder.parse_date_string(date_string, date_props, locale=locale)
-                    except locale.Error as e:
-                        raise e
-                    except Exception as e:
-                        logger.warning(f'Cannot parse date: {date}\n{e}')
-                        date = None
-                    if date:
-                        break
-                else:
-                    continue  # executed if the loop ended normally (no break)
-                break  # executed if 'continue' was skipped (break)
-        except TypeError:
+        date_string_tokens = date_string.split()
+        if not date_string_tokens:
             possible_matched.append(False)
             continue
+        date = None
+        for date_string in _iter_date_string_cuts(date_string, date_string_tokens):
+            try:
+                date = date_finder.parse_date_string(date_string, date_props, locale=locale)
+            except _locale.Error as e:
+                raise e
+            except Exception as e:
+                logger.warning(f'Cannot parse date: {date}\n{e}')
+                date = None
+            if date:
+                break
 
         if date and not check_date_parts_are_in_date(date, date_props):
             date = None
@@ -279,6 +302,25 @@ def get_raw_dates(text, strict=False, base_date=None,
             yield date
 
 
+@lru_cache(maxsize=256)
+def get_extra_tokens_regex(extra_tokens: FrozenSet[str]):
+    """
+    Get regex matching any of the tokens, the longest tokens first.
+    """
+    return re.compile('|'.join(re.escape(token) for token in sorted(extra_tokens, key=len, reverse=True)))
+
+
+def _iter_date_string_cuts(date_string: str, tokens: List[str]) -> Generator[str, None, None]:
+    """
+    Yield the date string itself and then the date string with 1, 2 ... tokens
+    cut off, from the end first and from the start second.
+    """
+    yield date_string
+    for cutter in range(1, len(tokens)):
+        yield ' '.join(tokens[:-cutter])
+        yield ' '.join(tokens[cutter:])
+
+
 def check_date_parts_are_in_date(
         date: datetime.datetime,
         date_props: Dict[str, List[Any]]
@@ -288,64 +330,54 @@ def check_date_parts_are_in_date(
     place for each "token" from the initial phrase
     :param date:
     :param date_string: "13.2 may"
-    :param date_props: {'time': [], 'hours': [] ... 'digits': ['13', '2'] ...}
+    :param date_props: {'time': [], 'hours': [] ... 'digits': ['13', '2'] ...},
+                       may hold lowercase 'months' as 'months_lower'
     :return: True if date is OK
     """
-
-    def _ordinal_to_cardinal(s: str) -> Optional[int]:
-        n: str = ''
-        for char in s:
-            if char.isdigit():
-                n: str = f'{n}{char}'
-        return int(n) if n else None
-
-    units_of_time: Tuple[str, ...] = ('year', 'month', 'day', 'hour', 'minute')
-    date_values: Dict[str, int] = {
-        unit: getattr(date, unit)
-        for unit in units_of_time
-    }
-
+    months_lower: Optional[List[str]] = date_props.get('months_lower')
+    if months_lower is None:
+        months_lower = [month.lower() for month in date_props['months']]
     date_prop_digits: List[int] = [int(d) for d in date_props['digits']]
-    date_prop_months: List[int] = [
-        MONTH_BY_NAME.get(month.lower())
-        for month in date_props['months']
-    ]
+    date_prop_months: List[Optional[int]] = [MONTH_BY_NAME.get(month) for month in months_lower]
     date_prop_days: List[int] = [
         day for day in
         (_ordinal_to_cardinal(n) for n in date_props['digits_modifier'])
         if day
     ]
+    return _date_parts_match(date.year, date.month, date.day, date.hour, date.minute,
+                             date_prop_digits, date_prop_months, date_prop_days)
 
-    # skip cases like "Section 7.7.10 may"
-    if date_prop_months:
-        month = date_values.get('month')
-        if month:
-            if month not in date_prop_months:
-                return False
-
-    combined: List[int] = [*date_prop_digits, *date_prop_months, *date_prop_days]
-    difference: Set[int] = set(combined).difference(date_values.values())
-
-    removeable: List[int] = []
-    reassembled_date: Dict[str, int] = {}
-    for k, v in date_values.items():
-        if k == 'year':
-            short_year = (v - 100 * (v // 100)) if v > 1000 else v
-            if short_year in combined:
-                reassembled_date[k] = v
-                removeable.append(short_year)
-                continue
-        if v in combined:
-            reassembled_date[k] = v
-            removeable.append(v)
 
-    diff_digits: List[int] = [digit for digit in difference if digit not in removeable]
-    diff_units: Set[str] = date_values.keys() - reassembled_date.keys()
+def _ordinal_to_cardinal(s: str) -> Optional[int]:
+    n: str = ''.join(char for char in s if char.isdigit())
+    return int(n) if n else None
 
-    if any(k for k in diff_units if k in units_of_time[:3]):
-        if diff_digits:
-            return False
-    return True
+
+def _date_parts_match(year: int,
+                      month: int,
+                      day: int,
+                      hour: int,
+                      minute: int,
+                      digits: List[int],
+                      months: List[Optional[int]],
+                      days: List[int]) -> bool:
+    """
+    Integer core of check_date_parts_are_in_date: the date is OK
+    if each of the digits, months and days is a part of the date
+    or if year (full or two-digit), month and day are all found among them.
+    """
+    # skip cases like "Section 7.7.10 may"
+    if months and month not in months:
+        return False
+
+    combined: Set[Optional[int]] = {*digits, *months, *days}
+    short_year = year % 100 if year > 1000 else year
+    difference = combined.difference((year, month, day, hour, minute))
+    difference.discard(short_year)
+    if not difference:
+        return True
+    return (short_year in combined or year in combined) \
+        and month in combined and day in combined
 
 
 def get_dates_list(text, **kwargs) -> List:
@@ -397,19 +429,73 @@ def get_date_annotations(text: str,
     raw_date_results = get_raw_dates(
         text, strict=strict, base_date=base_date, return_source=True, locale=Locale(locale))
 
-    for raw_date in raw_date_results:
-        feature_row = get_date_features(text, raw_date[1][0], raw_date[1][1], characters=DATE_MODEL_CHARS)
-        feature_list = len(feature_row) * [0.0]
-        for i, col in enumerate(MODEL_DATE.columns):
-            feature_list[i] = feature_row[col]
-        date_score = MODEL_DATE.predict_proba([feature_list])
-        if date_score[0, 1] >= threshold:
-            date, coordinates = raw_date
+    # encode the text only once there are raw dates to classify
+    text_bytes = None
+    for batch in _iter_batches(raw_date_results, DATE_CLASSIFIER_BATCH_SIZE):
+        if text_bytes is None:
+            text_bytes = encode_date_feature_text(text, DATE_FEATURE_TEXT_ENCODING)
+        yield from classify_raw_dates(text, batch, threshold,
+                                      text_bytes=text_bytes, text_encoding=DATE_FEATURE_TEXT_ENCODING)
+
+
+def _iter_batches(items: Iterable[Any], size: int) -> Generator[List[Any], None, None]:
+    iterator = iter(items)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def get_date_annotation_list(text: str, **kwargs) -> List[DateAnnotation]:
+    return list(get_date_annotations(text, **kwargs))
+
+
+def get_date_annotations_batch(texts: List[str],
+                               n_jobs: int = -1,
+                               **kwargs) -> List[List[DateAnnotation]]:
+    """
+    Find dates in each of the texts, processing the texts in parallel worker processes.
+    :param texts: raw texts to search
+    :param n_jobs: number of worker processes, -1 to use all CPUs
+    :param kwargs: get_date_annotations arguments
+    :return: date annotations for each of the texts
+    """
+    return Parallel(n_jobs=n_jobs, backend='loky')(
+        delayed(get_date_annotation_list)(text, **kwargs) for text in texts)
+
+
+def classify_raw_dates(text: str,
+                       raw_dates: List[Tuple[Any, Tuple[int, int]]],
+                       threshold: float = 0.50,
+                       text_bytes: Optional[bytes] = None,
+                       text_encoding: str = DATE_FEATURE_TEXT_ENCODING) \
+        -> Generator[DateAnnotation, None, None]:
+    """
+    Score (date, coordinates) pairs found by get_raw_dates with a single classifier call.
+    :param text: raw text the dates were found in
+    :param raw_dates: (date, (start, end)) pairs
+    :param threshold: probability threshold to use for false positive classifier
+    :param text_bytes: text encoded with encode_date_feature_text
+    :param text_encoding: encoding of text_bytes
+    :return:
+    """
+    if not raw_dates:
+        return
+    if text_bytes is None:
+        text_bytes = encode_date_feature_text(text, text_encoding)
+    feature_matrix = np.empty((len(raw_dates), len(DATE_FEATURE_ORDER)), dtype=np.float64)
+    for feature_row, (_date, (start, end)) in zip(feature_matrix, raw_dates):
+        get_date_features(text, start, end, characters=DATE_MODEL_CHARS,
+                          out_order=DATE_FEATURE_ORDER,
+                          text_bytes=text_bytes, text_encoding=text_encoding, out=feature_row)
+    date_scores = MODEL_DATE.predict_proba(feature_matrix)[:, 1]
+    for (date, coordinates), date_score in zip(raw_dates, date_scores):
+        if date_score >= threshold:
             annotation = DateAnnotation(
                 coords=coordinates,
                 text=text[slice(*coordinates)],
                 date=date,
-                score=date_score[0, 1]
+                score=date_score
             )
             yield annotation
 
@@ -30,7 +30,8 @@ import random
 import string
 
 from lexnlp.extract.en.dates import get_dates_list, get_date_features, \
-    get_raw_date_list
+    get_raw_date_list, get_date_annotation_list, get_date_annotations_batch, classify_raw_dates, \
+    DATE_CLASSIFIER_BATCH_SIZE
 from lexnlp.tests import lexnlp_tests
 
 
@@ -70,6 +71,30 @@ class TestDates(TestCase):
                                   return_source=True)
         self.assertEqual(1, len(dates))
 
+    def test_bare_numbers_are_not_raw_dates(self):
+        """
+        Test that bare years and numbers never reach the false positive classifier.
+        """
+        for text in ['2019', 'In 2019 the parties', 'paid 1234 to 5678', 'the 31 items']:
+            for strict in (False, True):
+                self.assertEqual([], get_raw_date_list(text, strict=strict))
+
+    def test_raw_dates_base_date_timezone(self):
+        """
+        Test that equal base dates in different timezones keep their own timezone.
+        """
+        text = 'The meeting is at 10:30 am on June 1, 2020 in the hall'
+        utc = datetime.timezone.utc
+        plus_5 = datetime.timezone(datetime.timedelta(hours=5))
+        base_utc = datetime.datetime(2020, 1, 1, 0, tzinfo=utc)
+        base_plus_5 = datetime.datetime(2020, 1, 1, 5, tzinfo=plus_5)
+        self.assertEqual(base_utc, base_plus_5)
+        self.assertEqual([datetime.datetime(2020, 6, 1, 10, 30, tzinfo=utc)],
+                         get_raw_date_list(text, base_date=base_utc))
+        dates = get_raw_date_list(text, base_date=base_plus_5)
+        self.assertEqual([datetime.datetime(2020, 6, 1, 10, 30, tzinfo=plus_5)], dates)
+        self.assertEqual(plus_5.utcoffset(None), dates[0].utcoffset())
+
     def test_fixed_raw_dates(self):
         """
         Test raw date extraction from fixed examples.
@@ -114,6 +139,29 @@ class TestDates(TestCase):
             expected_data_converter=expected_data_converter,
             actual_data_converter=lambda actual: [d[0] for d in actual])
 
+    def test_date_annotations_batch(self):
+        texts = [EXAMPLE_TEXT_1, "this may be a date", "Effective as of June 1, 2019 and until 2020-02-02."]
+        batch = get_date_annotations_batch(texts, n_jobs=2)
+        self.assertEqual(len(texts), len(batch))
+        for text, annotations in zip(texts, batch):
+            expected = get_date_annotation_list(text)
+            self.assertEqual([(a.coords, a.date) for a in expected],
+                             [(a.coords, a.date) for a in annotations])
+        self.assertEqual(0, len(batch[1]))
+
+    def test_classify_no_raw_dates(self):
+        self.assertEqual([], list(classify_raw_dates(EXAMPLE_TEXT_1, [])))
+
+    def test_date_annotations_over_batch_size(self):
+        text = ' '.join(f'Payment {i} is due on {datetime.date(2001 + i % 20, 1 + i % 12, 1 + i % 28):%B %d, %Y}.'
+                        for i in range(DATE_CLASSIFIER_BATCH_SIZE + 10))
+        raw_dates = get_raw_date_list(text, return_source=True)
+        self.assertGreater(len(raw_dates), DATE_CLASSIFIER_BATCH_SIZE)
+        expected = [a for raw_date in raw_dates for a in classify_raw_dates(text, [raw_date])]
+        annotations = get_date_annotation_list(text)
+        self.assertEqual([(a.coords, a.date) for a in expected],
+                         [(a.coords, a.date) for a in annotations])
+
     def test_fixed_date_set(self):
         date_src = [(1990, 2, 2), (2017, 1, 1), (1836, 12, 23),
                     (2019, 11, 30), (2101, 1, 14)]
@@ -0,0 +1,27 @@
+__author__ = "ContraxSuite, LLC; LexPredict, LLC"
+__copyright__ = "Copyright 2015-2021, ContraxSuite, LLC"
+__license__ = "https://github.com/LexPredict/lexpredict-lexnlp/blob/2.3.0/LICENSE"
+__version__ = "2.3.0"
+__maintainer__ = "LexPredict, LLC"
+__email__ = "support@contraxsuite.com"
+
+
+import io
+import pickle
+from fractions import Fraction
+from unittest import TestCase
+from unittest.mock import patch
+
+from lexnlp.utils.unpickler import RenameUnpickler, renamed_load
+
+
+class TestUnpickler(TestCase):
+
+    def test_load(self):
+        data = pickle.dumps({'ratio': Fraction(1, 3)})
+        self.assertEqual({'ratio': Fraction(1, 3)}, renamed_load(io.BytesIO(data)))
+
+    def test_load_renamed_module(self):
+        data = pickle.dumps(Fraction(1, 3), protocol=0).replace(b'cfractions\n', b'cold_fractions\n')
+        with patch.dict(RenameUnpickler.RENAMED_MODULES, {'old_fractions': 'fractions'}):
+            self.assertEqual(Fraction(1, 3), renamed_load(io.BytesIO(data)))
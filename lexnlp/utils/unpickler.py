@@ -1,11 +1,18 @@
 import pickle
+from typing import Dict
 
 
 class RenameUnpickler(pickle.Unpickler):
+    # old module path -> new module path of the pickled classes
+    RENAMED_MODULES: Dict[str, str] = {}
+
     def find_class(self, module, name):
-        renamed_module = module
+        renamed_module = self.RENAMED_MODULES.get(module, module)
         return super(RenameUnpickler, self).find_class(renamed_module, name)
 
 
 def renamed_load(file_obj):
+    if not RenameUnpickler.RENAMED_MODULES:
+        # nothing to rename: don't make the unpickler call back find_class() for each class
+        return pickle.load(file_obj)
     return RenameUnpickler(file_obj).load()